@@ -1,6 +1,11 @@
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 from services.email_service import EmailService
+from services.pipeline import serialize
+from services.compression import compress_response
+from services.folder_cache import FolderCache
+from services.prefetch import PrefetchScheduler
+from services.rule_engine import RuleEngine
 import logging
 import os
 from dotenv import load_dotenv
@@ -18,6 +23,58 @@ logger = logging.getLogger(__name__)
 # Initialize email service
 email_service = EmailService()
 
+# Folders kept warm by the prefetch scheduler, mapped to their EmailService fetchers
+PREFETCH_FOLDERS = {
+    'inbox': 'receive_emails',
+    'starred': 'get_starred_emails',
+    'sent': 'get_sent_emails'
+}
+folder_cache = FolderCache(
+    cache_dir=os.environ.get('FOLDER_CACHE_DIR'),
+    ttl=int(os.environ.get('FOLDER_CACHE_TTL', 300))
+)
+prefetch_scheduler = None
+
+# Auto-labelling rules, applied to each new inbox sync
+RULES_FILE = os.environ.get('RULES_FILE', 'rules.json')
+RULES_DRY_RUN = os.environ.get('RULES_DRY_RUN', 'true').lower() == 'true'
+rule_engine = None
+
+# Response compression settings
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', 1024))
+
+# Upper bound on max_results accepted from clients
+MAX_RESULTS_LIMIT = 500
+
+def fetch_folder(folder):
+    """Return a folder result, served from the warm cache when the scheduler is running."""
+    folder_cache.mark_activity()
+    fetch = getattr(email_service, PREFETCH_FOLDERS[folder])
+    if prefetch_scheduler is None:
+        return fetch()
+
+    cached = folder_cache.get(folder)
+    if cached is not None:
+        logger.info(f"Serving {folder} from cache")
+        return cached
+
+    result = fetch()
+    if result.get('success') and not result.get('partial'):
+        folder_cache.put(folder, result)
+    return result
+
+@app.after_request
+def compress_json(response):
+    """Compress JSON responses above the size threshold."""
+    return compress_response(response, request.accept_encodings, COMPRESSION_MIN_SIZE)
+
+def render_emails(result):
+    """Serialize a folder result, honouring the ?view=compact query parameter."""
+    if result.get('emails'):
+        view = 'compact' if request.args.get('view') == 'compact' else 'full'
+        result = dict(result, emails=list(serialize(result['emails'], view)))
+    return jsonify(result)
+
 def ensure_authenticated():
     """Ensure the email service is authenticated before processing requests."""
     try:
@@ -43,6 +100,8 @@ def send_email():
             body=data['body']
         )
         logger.info(f"Send email result: {result}")
+        if result.get('success'):
+            folder_cache.invalidate('sent')
         return jsonify(result)
     except Exception as e:
         logger.error(f"Error sending email: {str(e)}")
@@ -57,9 +116,9 @@ def receive_emails():
         ensure_authenticated()
         logger.info("Received receive emails request")
         
-        result = email_service.receive_emails()
+        result = fetch_folder('inbox')
         logger.info(f"Receive emails result: {result}")
-        return jsonify(result)
+        return render_emails(result)
     except Exception as e:
         logger.error(f"Error receiving emails: {str(e)}")
         return jsonify({
@@ -74,9 +133,9 @@ def get_sent_emails():
         ensure_authenticated()
         logger.info("Received get sent emails request")
         
-        result = email_service.get_sent_emails()
+        result = fetch_folder('sent')
         logger.info(f"Get sent emails result: {result}")
-        return jsonify(result)
+        return render_emails(result)
     except Exception as e:
         logger.error(f"Error getting sent emails: {str(e)}")
         return jsonify({
@@ -91,9 +150,10 @@ def get_spam_emails():
         ensure_authenticated()
         logger.info("Received get spam emails request")
         
+        folder_cache.mark_activity()
         result = email_service.get_spam_emails()
         logger.info(f"Get spam emails result: {result}")
-        return jsonify(result)
+        return render_emails(result)
     except Exception as e:
         logger.error(f"Error getting spam emails: {str(e)}")
         return jsonify({
@@ -102,6 +162,36 @@ def get_spam_emails():
             'emails': []
         }), 500
 
+@app.route('/api/emails', methods=['GET'])
+def get_emails():
+    """Get emails for any labels and Gmail search query, e.g. ?label=Receipts&q=is:unread."""
+    try:
+        ensure_authenticated()
+        folder_cache.mark_activity()
+        labels = [name for value in request.args.getlist('label') for name in value.split(',') if name]
+        q = request.args.get('q')
+        max_results = min(request.args.get('max_results', 5, type=int), MAX_RESULTS_LIMIT)
+        logger.info(f"Received get emails request: labels={labels} q={q}")
+        
+        label_ids = email_service.resolve_label_ids(labels) if labels else None
+        result = email_service.fetch_emails(
+            label_ids=label_ids,
+            q=q,
+            max_results=max_results,
+            strategy=request.args.get('strategy'),
+            spam_score=request.args.get('spam_score') == 'true'
+        )
+        return render_emails(result)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e), 'emails': []}), 400
+    except Exception as e:
+        logger.error(f"Error getting emails: {str(e)}")
+        return jsonify({
+            'success': False,
+            'message': f'Failed to get emails: {str(e)}',
+            'emails': []
+        }), 500
+
 @app.route('/api/emails/<message_id>', methods=['DELETE'])
 def delete_email(message_id):
     try:
@@ -110,6 +200,8 @@ def delete_email(message_id):
         
         result = email_service.delete_email(message_id)
         logger.info(f"Delete email result: {result}")
+        if result.get('success'):
+            folder_cache.invalidate()
         return jsonify(result)
     except Exception as e:
         logger.error(f"Error deleting email: {str(e)}")
@@ -140,8 +232,9 @@ def get_all_emails():
     """Get all emails."""
     try:
         ensure_authenticated()
+        folder_cache.mark_activity()
         result = email_service.get_all_emails()
-        return jsonify(result)
+        return render_emails(result)
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
@@ -150,8 +243,8 @@ def get_starred_emails():
     """Get starred emails."""
     try:
         ensure_authenticated()
-        result = email_service.get_starred_emails()
-        return jsonify(result)
+        result = fetch_folder('starred')
+        return render_emails(result)
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
@@ -162,12 +255,101 @@ def toggle_star(message_id):
         ensure_authenticated()
         starred = request.json.get('starred', True)
         result = email_service.toggle_star(message_id, starred)
+        if result.get('success'):
+            folder_cache.invalidate()
         return jsonify(result)
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
+@app.route('/api/rules/apply', methods=['POST'])
+def apply_rules():
+    """Run the rules over recent inbox emails, reporting changes without applying them by default."""
+    try:
+        ensure_authenticated()
+        if rule_engine is None:
+            return jsonify({'success': False, 'message': 'No rules loaded'}), 400
+        data = request.get_json(silent=True) or {}
+        dry_run = data.get('dry_run', True)
+        try:
+            max_results = min(int(data.get('max_results', 50)), MAX_RESULTS_LIMIT)
+        except (TypeError, ValueError):
+            return jsonify({'success': False, 'message': 'max_results must be an integer'}), 400
+        logger.info(f"Received apply rules request (dry_run={dry_run})")
+        
+        emails = email_service.receive_emails(max_results=max_results)
+        if not emails['success']:
+            return jsonify(emails), 500
+        result = rule_engine.apply(email_service, emails['emails'], dry_run=dry_run)
+        if result['success'] and not dry_run and result['matches']:
+            folder_cache.invalidate()
+        return jsonify(result)
+    except Exception as e:
+        logger.error(f"Error applying rules: {str(e)}")
+        return jsonify({
+            'success': False,
+            'message': f'Failed to apply rules: {str(e)}'
+        }), 500
+
+def load_rules():
+    """Compile the rules file, if one is configured."""
+    global rule_engine
+    if not os.path.exists(RULES_FILE):
+        logger.info(f"No rules file found at {RULES_FILE}, rules disabled")
+        return
+    rule_engine = RuleEngine.from_file(RULES_FILE)
+    logger.info(f"Loaded {len(rule_engine.rules)} rules from {RULES_FILE}")
+
+def apply_rules_to_sync(service):
+    """Apply rules to inbox emails that arrived since the last watermark."""
+    if rule_engine is None:
+        return
+    report = rule_engine.apply_delta(service, folder_cache, dry_run=RULES_DRY_RUN)
+    if not report['success']:
+        logger.error(f"Error applying rules to sync: {report['message']}")
+    elif report['matches']:
+        logger.info(f"Rules matched new emails: {report['matches']}")
+        if not RULES_DRY_RUN:
+            folder_cache.invalidate()
+
+def start_prefetch():
+    """Start the background scheduler that keeps hot folders warm."""
+    global prefetch_scheduler
+    if os.environ.get('PREFETCH_ENABLED', 'true').lower() != 'true':
+        logger.info("Prefetch scheduler disabled")
+        return
+    prefetch_scheduler = PrefetchScheduler(
+        email_service.fork(),
+        folder_cache,
+        PREFETCH_FOLDERS,
+        min_interval=int(os.environ.get('PREFETCH_MIN_INTERVAL', 30)),
+        max_interval=int(os.environ.get('PREFETCH_MAX_INTERVAL', 240)),
+        active_window=int(os.environ.get('PREFETCH_ACTIVE_WINDOW', 120)),
+        max_failure_interval=int(os.environ.get('PREFETCH_MAX_FAILURE_INTERVAL', 900)),
+        on_sync=apply_rules_to_sync
+    )
+    prefetch_scheduler.start()
+
+def start_background_services():
+    """Load rules and start prefetching; called by initialize_app and each gunicorn worker."""
+    try:
+        if not email_service.is_authenticated():
+            # Never start an interactive OAuth flow from a worker; wait for a saved token
+            if not os.path.exists('token.json'):
+                logger.error("token.json not found, background services not started")
+                return False
+            if not email_service.authenticate():
+                logger.error("Failed to authenticate with Gmail, background services not started")
+                return False
+        
+        load_rules()
+        start_prefetch()
+        return True
+    except Exception as e:
+        logger.error(f"Error starting background services: {str(e)}")
+        return False
+
 def initialize_app():
-    """Initialize the application and force authentication."""
+    """Initialize the application, force authentication and start prefetching."""
     try:
         logger.info("Starting application initialization")
         
@@ -182,6 +364,8 @@ def initialize_app():
             logger.error("Failed to authenticate with Gmail")
             return False
         
+        start_background_services()
+        
         logger.info("Application initialization successful")
         return True
     except Exception as e:
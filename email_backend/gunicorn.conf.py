@@ -0,0 +1,11 @@
+# Gunicorn settings for the email backend
+
+
+def post_worker_init(worker):
+    """Start the prefetch scheduler and rules in every worker once the app is loaded.
+
+    Workers coordinate through the shared folder cache lock, so only one of
+    them syncs with Gmail at a time.
+    """
+    from app import start_background_services
+    start_background_services()
@@ -0,0 +1,44 @@
+import gzip
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; fall back to gzip only
+    brotli = None
+
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+def choose_encoding(accept):
+    """Pick the best encoding from a parsed Accept-Encoding header, preferring brotli on ties."""
+    gzip_quality = accept.quality('gzip')
+    brotli_quality = accept.quality('br') if brotli is not None else 0
+    if brotli_quality > 0 and brotli_quality >= gzip_quality:
+        return 'br'
+    if gzip_quality > 0:
+        return 'gzip'
+    return None
+
+def compress_response(response, accept, min_size):
+    """Compress a JSON response of at least min_size bytes in the best accepted encoding."""
+    if (response.direct_passthrough
+            or response.mimetype != 'application/json'
+            or 'Content-Encoding' in response.headers):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    data = response.get_data()
+    if len(data) < min_size:
+        return response
+
+    encoding = choose_encoding(accept)
+    if encoding == 'br':
+        data = brotli.compress(data, quality=BROTLI_QUALITY)
+    elif encoding == 'gzip':
+        data = gzip.compress(data, compresslevel=GZIP_LEVEL)
+    else:
+        return response
+
+    response.set_data(data)
+    response.headers['Content-Encoding'] = encoding
+    response.headers['Content-Length'] = str(len(data))
+    return response
@@ -13,6 +13,8 @@ import smtplib
 import ssl
 import httplib2
 from .spam_filter import SpamFilter
+from .labels import SPAM_REMOVE_LABELS, SYSTEM_LABEL_IDS
+from . import pipeline
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -25,6 +27,12 @@ SCOPES = [
     'https://www.googleapis.com/auth/gmail.send'  # Send emails
 ]
 
+# Fetch strategy used when a caller does not pick one (sequential, batched or threaded)
+DEFAULT_FETCH_STRATEGY = os.environ.get('FETCH_STRATEGY', 'batched')
+
+# Maximum number of message IDs accepted by a single batchModify call
+BATCH_MODIFY_LIMIT = 1000
+
 class EmailService:
     def __init__(self):
         self.creds = None
@@ -80,6 +88,19 @@ class EmailService:
             self._authenticated = False
             return False
 
+    def fork(self):
+        """Create a service that shares these credentials but has its own HTTP connection.
+
+        httplib2 connections are not thread-safe, so background threads must not
+        share the request thread's Gmail client.
+        """
+        clone = EmailService()
+        clone.creds = self.creds
+        clone.service = build('gmail', 'v1', credentials=self.creds)
+        clone.spam_filter = self.spam_filter
+        clone._authenticated = True
+        return clone
+
     def send_email(self, to, subject, body):
         """Send an email using Gmail API."""
         try:
@@ -101,179 +122,59 @@ class EmailService:
             logger.error(f"Error sending email: {str(e)}")
             return {'success': False, 'message': str(e)}
 
-    def receive_emails(self, max_results=5):
-        """Receive emails from Gmail."""
+    def fetch_emails(self, label_ids=None, q=None, max_results=5, strategy=None, spam_score=False, message_ids=None):
+        """Run the list, fetch, parse and enrich pipeline for any label/query selector.
+
+        Passing message_ids skips the list stage and fetches exactly those messages.
+        Serialization to the full or compact view happens in the route.
+        """
+        if message_ids is not None:
+            selector = f"{len(message_ids)} message ids"
+        else:
+            selector = f"labels={label_ids or 'ALL'} q={q or ''}"
+        fetcher = pipeline.get_fetcher(strategy or DEFAULT_FETCH_STRATEGY)
         try:
-            logger.info("Starting to receive emails")
-            results = self.service.users().messages().list(
-                userId='me',
-                maxResults=max_results,
-                labelIds=['INBOX']
-            ).execute()
-            messages = results.get('messages', [])
-            
-            if not messages:
-                logger.info("No messages found")
-                return {'success': True, 'emails': []}
-            
-            logger.info(f"Found {len(messages)} messages")
-            emails = []
-            
-            for message in messages:
-                try:
-                    msg = self.service.users().messages().get(userId='me', id=message['id']).execute()
-                    email_data = self._parse_email(msg)
-                    if email_data:  # Only add if parsing was successful
-                        emails.append(email_data)
-                except Exception as e:
-                    logger.error(f"Error processing message {message['id']}: {str(e)}")
-                    continue
-            
-            logger.info(f"Successfully processed {len(emails)} emails")
-            return {'success': True, 'emails': emails}
+            logger.info(f"Starting to get emails ({selector})")
+            if message_ids is None:
+                message_ids = pipeline.list_message_ids(self.service, label_ids, q, max_results)
+            failed_ids = []
+            messages = fetcher.fetch(self, message_ids, failed_ids)
+            emails = pipeline.parse(self, messages)
+            if spam_score:
+                emails = pipeline.enrich(self.spam_filter, emails)
+            emails = list(emails)
+            
+            logger.info(f"Successfully processed {len(emails)} emails ({selector})")
+            result = {'success': True, 'emails': emails}
+            if failed_ids:
+                logger.warning(f"Failed to fetch {len(failed_ids)} emails ({selector})")
+                result['partial'] = True
+                result['failed_ids'] = failed_ids
+            return result
             
         except Exception as e:
-            logger.error(f"Error receiving emails: {str(e)}")
+            logger.error(f"Error getting emails ({selector}): {str(e)}")
             return {'success': False, 'message': str(e), 'emails': []}
 
+    def receive_emails(self, max_results=5):
+        """Receive emails from Gmail."""
+        return self.fetch_emails(label_ids=['INBOX'], max_results=max_results)
+
     def get_sent_emails(self, max_results=5):
         """Get sent emails from Gmail."""
-        try:
-            logger.info("Starting to get sent emails")
-            results = self.service.users().messages().list(
-                userId='me',
-                labelIds=['SENT'],
-                maxResults=max_results
-            ).execute()
-            messages = results.get('messages', [])
-            
-            if not messages:
-                logger.info("No sent messages found")
-                return {'success': True, 'emails': []}
-            
-            logger.info(f"Found {len(messages)} sent messages")
-            emails = []
-            
-            for message in messages:
-                try:
-                    msg = self.service.users().messages().get(userId='me', id=message['id']).execute()
-                    email_data = self._parse_email(msg)
-                    if email_data:  # Only add if parsing was successful
-                        emails.append(email_data)
-                except Exception as e:
-                    logger.error(f"Error processing sent message {message['id']}: {str(e)}")
-                    continue
-            
-            logger.info(f"Successfully processed {len(emails)} sent emails")
-            return {'success': True, 'emails': emails}
-            
-        except Exception as e:
-            logger.error(f"Error getting sent emails: {str(e)}")
-            return {'success': False, 'message': str(e), 'emails': []}
+        return self.fetch_emails(label_ids=['SENT'], max_results=max_results)
 
     def get_spam_emails(self, max_results=5):
         """Get spam emails from Gmail."""
-        try:
-            logger.info("Starting to get spam emails")
-            results = self.service.users().messages().list(
-                userId='me',
-                labelIds=['SPAM'],
-                maxResults=max_results
-            ).execute()
-            messages = results.get('messages', [])
-            
-            if not messages:
-                logger.info("No spam messages found")
-                return {'success': True, 'emails': []}
-            
-            logger.info(f"Found {len(messages)} spam messages")
-            emails = []
-            
-            for message in messages:
-                try:
-                    msg = self.service.users().messages().get(userId='me', id=message['id']).execute()
-                    email_data = self._parse_email(msg)
-                    if email_data:  # Only add if parsing was successful
-                        emails.append(email_data)
-                except Exception as e:
-                    logger.error(f"Error processing spam message {message['id']}: {str(e)}")
-                    continue
-            
-            logger.info(f"Successfully processed {len(emails)} spam emails")
-            return {'success': True, 'emails': emails}
-            
-        except Exception as e:
-            logger.error(f"Error getting spam emails: {str(e)}")
-            return {'success': False, 'message': str(e), 'emails': []}
+        return self.fetch_emails(label_ids=['SPAM'], max_results=max_results)
 
     def get_all_emails(self, max_results=5):
         """Get all emails from Gmail."""
-        try:
-            logger.info("Starting to get all emails")
-            results = self.service.users().messages().list(
-                userId='me',
-                maxResults=max_results
-            ).execute()
-            messages = results.get('messages', [])
-            
-            if not messages:
-                logger.info("No messages found")
-                return {'success': True, 'emails': []}
-            
-            logger.info(f"Found {len(messages)} messages")
-            emails = []
-            
-            for message in messages:
-                try:
-                    msg = self.service.users().messages().get(userId='me', id=message['id']).execute()
-                    email_data = self._parse_email(msg)
-                    if email_data:  # Only add if parsing was successful
-                        emails.append(email_data)
-                except Exception as e:
-                    logger.error(f"Error processing message {message['id']}: {str(e)}")
-                    continue
-            
-            logger.info(f"Successfully processed {len(emails)} emails")
-            return {'success': True, 'emails': emails}
-            
-        except Exception as e:
-            logger.error(f"Error getting all emails: {str(e)}")
-            return {'success': False, 'message': str(e), 'emails': []}
+        return self.fetch_emails(max_results=max_results)
 
     def get_starred_emails(self, max_results=5):
         """Get starred emails from Gmail."""
-        try:
-            logger.info("Starting to get starred emails")
-            results = self.service.users().messages().list(
-                userId='me',
-                labelIds=['STARRED'],
-                maxResults=max_results
-            ).execute()
-            messages = results.get('messages', [])
-            
-            if not messages:
-                logger.info("No starred messages found")
-                return {'success': True, 'emails': []}
-            
-            logger.info(f"Found {len(messages)} starred messages")
-            emails = []
-            
-            for message in messages:
-                try:
-                    msg = self.service.users().messages().get(userId='me', id=message['id']).execute()
-                    email_data = self._parse_email(msg)
-                    if email_data:  # Only add if parsing was successful
-                        emails.append(email_data)
-                except Exception as e:
-                    logger.error(f"Error processing starred message {message['id']}: {str(e)}")
-                    continue
-            
-            logger.info(f"Successfully processed {len(emails)} starred emails")
-            return {'success': True, 'emails': emails}
-            
-        except Exception as e:
-            logger.error(f"Error getting starred emails: {str(e)}")
-            return {'success': False, 'message': str(e), 'emails': []}
+        return self.fetch_emails(label_ids=['STARRED'], max_results=max_results)
 
     def toggle_star(self, message_id, starred=True):
         """Toggle star status of an email."""
@@ -338,6 +239,7 @@ class EmailService:
                 'from': from_header,
                 'date': date,
                 'body': body,
+                'snippet': message.get('snippet', ''),
                 'is_unread': is_unread,
                 'is_starred': is_starred
             }
@@ -375,13 +277,104 @@ class EmailService:
             self.service.users().messages().modify(
                 userId='me',
                 id=message_id,
-                body={'removeLabelIds': ['INBOX', 'CATEGORY_PERSONAL', 'CATEGORY_SOCIAL', 'CATEGORY_PROMOTIONS', 'CATEGORY_UPDATES', 'CATEGORY_FORUMS'], 'addLabelIds': ['SPAM']}
+                body={'removeLabelIds': SPAM_REMOVE_LABELS, 'addLabelIds': ['SPAM']}
             ).execute()
             return True, "Email moved to spam"
         except Exception as e:
             print(f"Error moving to spam: {str(e)}")
             return False, str(e)
     
+    def batch_modify(self, message_ids, add_label_ids=None, remove_label_ids=None):
+        """Apply the same label changes to many emails, chunked to the batchModify limit."""
+        try:
+            body = {}
+            if add_label_ids:
+                body['addLabelIds'] = list(add_label_ids)
+            if remove_label_ids:
+                body['removeLabelIds'] = list(remove_label_ids)
+            
+            for start in range(0, len(message_ids), BATCH_MODIFY_LIMIT):
+                chunk = message_ids[start:start + BATCH_MODIFY_LIMIT]
+                self.service.users().messages().batchModify(
+                    userId='me',
+                    body=dict(body, ids=chunk)
+                ).execute()
+            
+            logger.info(f"Batch modified {len(message_ids)} emails")
+            return {'success': True, 'message': f'Modified {len(message_ids)} emails'}
+            
+        except Exception as e:
+            logger.error(f"Error batch modifying emails: {str(e)}")
+            return {'success': False, 'message': str(e)}
+    
+    def get_label_ids(self, names=None, create_missing=False):
+        """Map label names to Gmail label IDs, optionally creating missing user labels."""
+        results = self.service.users().labels().list(userId='me').execute()
+        label_ids = {label['name']: label['id'] for label in results.get('labels', [])}
+        
+        if create_missing and names:
+            for name in names:
+                if name not in label_ids:
+                    logger.info(f"Creating label: {name}")
+                    label = self.service.users().labels().create(
+                        userId='me',
+                        body={'name': name}
+                    ).execute()
+                    label_ids[name] = label['id']
+        
+        return label_ids
+    
+    def get_history_id(self):
+        """Return the mailbox's current history ID."""
+        return self.service.users().getProfile(userId='me').execute()['historyId']
+    
+    def get_new_message_ids(self, start_history_id, label_id='INBOX'):
+        """List messages added to a label since a history ID, following every page."""
+        try:
+            message_ids = []
+            history_id = start_history_id
+            page_token = None
+            while True:
+                params = {
+                    'userId': 'me',
+                    'startHistoryId': start_history_id,
+                    'historyTypes': ['messageAdded'],
+                    'labelId': label_id
+                }
+                if page_token:
+                    params['pageToken'] = page_token
+                results = self.service.users().history().list(**params).execute()
+                for record in results.get('history', []):
+                    for added in record.get('messagesAdded', []):
+                        message_ids.append(added['message']['id'])
+                history_id = results.get('historyId', history_id)
+                page_token = results.get('nextPageToken')
+                if not page_token:
+                    break
+            
+            # A message can appear in several history records
+            message_ids = list(dict.fromkeys(message_ids))
+            logger.info(f"Found {len(message_ids)} new messages since history {start_history_id}")
+            return {'success': True, 'message_ids': message_ids, 'history_id': history_id}
+            
+        except Exception as e:
+            # Gmail answers 404 once a history ID is too old to list from
+            expired = getattr(getattr(e, 'resp', None), 'status', None) == 404
+            logger.error(f"Error listing history: {str(e)}")
+            return {'success': False, 'message': str(e), 'expired': expired}
+    
+    def resolve_label_ids(self, names):
+        """Translate label names or IDs to IDs, skipping the lookup for system labels."""
+        if all(name in SYSTEM_LABEL_IDS for name in names):
+            return list(names)
+        
+        label_ids = self.get_label_ids()
+        known_ids = set(label_ids.values())
+        missing = [name for name in names if name not in label_ids and name not in known_ids]
+        if missing:
+            raise ValueError(f"Unknown label: {', '.join(missing)}")
+        return [label_ids.get(name, name) for name in names]
+    
     def delete_email(self, message_id):
         """Delete an email permanently."""
         try:
@@ -0,0 +1,86 @@
+import os
+import json
+import time
+import logging
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+class FolderCache:
+    """File-backed cache of folder results, shared by all workers on a host."""
+
+    def __init__(self, cache_dir=None, ttl=300):
+        self.cache_dir = cache_dir or os.path.join(tempfile.gettempdir(), 'email_backend_cache')
+        self.ttl = ttl
+        self._activity_file = os.path.join(self.cache_dir, '.activity')
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _path(self, folder):
+        return os.path.join(self.cache_dir, f'{folder}.json')
+
+    def _state_path(self, name):
+        return os.path.join(self.cache_dir, f'.{name}.state')
+
+    def get(self, folder):
+        """Return the cached result for a folder, or None if missing or expired."""
+        path = self._path(folder)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                return None
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def put(self, folder, result):
+        """Atomically store a folder result so concurrent readers never see partial data."""
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(result, f)
+            os.replace(tmp_path, self._path(folder))
+        except OSError as e:
+            logger.error(f"Error writing cache for {folder}: {str(e)}")
+
+    def get_state(self, name):
+        """Return a small piece of shared worker state, or None if it was never stored."""
+        try:
+            with open(self._state_path(name)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def put_state(self, name, value):
+        """Atomically store shared worker state; unlike folders it never expires."""
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(value, f)
+            os.replace(tmp_path, self._state_path(name))
+        except OSError as e:
+            logger.error(f"Error writing state {name}: {str(e)}")
+
+    def invalidate(self, *folders):
+        """Drop the given folders, or every folder when none are named."""
+        if not folders:
+            folders = [name[:-len('.json')] for name in os.listdir(self.cache_dir) if name.endswith('.json')]
+        for folder in folders:
+            try:
+                os.remove(self._path(folder))
+            except OSError:
+                pass
+
+    def mark_activity(self):
+        """Record that a client just requested mail."""
+        try:
+            with open(self._activity_file, 'a'):
+                os.utime(self._activity_file, None)
+        except OSError:
+            pass
+
+    def last_activity(self):
+        """Timestamp of the most recent client request across all workers."""
+        try:
+            return os.path.getmtime(self._activity_file)
+        except OSError:
+            return 0
@@ -0,0 +1,8 @@
+# Gmail label constants shared by the email service and the rule engine
+
+# Labels stripped from a message when it is moved to spam
+SPAM_REMOVE_LABELS = ['INBOX', 'CATEGORY_PERSONAL', 'CATEGORY_SOCIAL', 'CATEGORY_PROMOTIONS', 'CATEGORY_UPDATES', 'CATEGORY_FORUMS']
+
+# Gmail system labels, usable as IDs without a labels lookup
+SYSTEM_LABEL_IDS = {'INBOX', 'SENT', 'DRAFT', 'SPAM', 'TRASH', 'STARRED', 'UNREAD', 'IMPORTANT',
+                    'CATEGORY_PERSONAL', 'CATEGORY_SOCIAL', 'CATEGORY_PROMOTIONS', 'CATEGORY_UPDATES', 'CATEGORY_FORUMS'}
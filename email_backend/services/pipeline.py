@@ -0,0 +1,211 @@
+import html
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Gmail caps messages.list pages at 500 results
+LIST_PAGE_LIMIT = 500
+
+# Retry policy for rate limited or transiently failing message fetches
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+RATE_LIMIT_REASONS = ('rateLimitExceeded', 'userRateLimitExceeded')
+MAX_RETRIES = 3
+RETRY_BASE_DELAY = 1  # seconds, doubled after each attempt
+
+# Compact view settings
+COMPACT_SNIPPET_LENGTH = 100
+
+def list_message_ids(service, label_ids=None, q=None, max_results=5):
+    """Yield message IDs matching the labels and query, following pages until max_results."""
+    page_token = None
+    remaining = max_results
+    while remaining > 0:
+        params = {'userId': 'me', 'maxResults': min(remaining, LIST_PAGE_LIMIT)}
+        if label_ids:
+            params['labelIds'] = label_ids
+        if q:
+            params['q'] = q
+        if page_token:
+            params['pageToken'] = page_token
+
+        results = service.users().messages().list(**params).execute()
+        messages = results.get('messages', [])
+        for message in messages:
+            yield message['id']
+
+        remaining -= len(messages)
+        page_token = results.get('nextPageToken')
+        if not messages or not page_token:
+            return
+
+def _status(exception):
+    return getattr(getattr(exception, 'resp', None), 'status', None)
+
+def is_retryable(exception):
+    """Whether a Gmail error is a rate limit or transient server error worth retrying."""
+    status = _status(exception)
+    if status in RETRYABLE_STATUSES:
+        return True
+    content = getattr(exception, 'content', b'') or b''
+    if isinstance(content, bytes):
+        content = content.decode('utf-8', 'ignore')
+    return status == 403 and any(reason in content for reason in RATE_LIMIT_REASONS)
+
+def _record_failure(message_id, exception, failed_ids):
+    # A message deleted between listing and fetching is simply gone, not missing
+    if _status(exception) == 404:
+        logger.info(f"Message {message_id} no longer exists, skipping")
+        return
+    logger.error(f"Error processing message {message_id}: {str(exception)}")
+    failed_ids.append(message_id)
+
+def get_with_retry(service, message_id):
+    """Fetch one message, retrying rate limits and transient errors with exponential backoff."""
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            return service.users().messages().get(userId='me', id=message_id).execute()
+        except Exception as e:
+            if attempt == MAX_RETRIES or not is_retryable(e):
+                raise
+            time.sleep(RETRY_BASE_DELAY * 2 ** attempt)
+
+class SequentialFetcher:
+    """Fetch messages one request at a time."""
+
+    def fetch(self, email_service, message_ids, failed_ids):
+        for message_id in message_ids:
+            try:
+                yield get_with_retry(email_service.service, message_id)
+            except Exception as e:
+                _record_failure(message_id, e, failed_ids)
+
+class BatchedFetcher:
+    """Fetch messages through Gmail batch requests, many messages per HTTP round trip."""
+
+    def __init__(self, batch_size=50):
+        self.batch_size = batch_size
+
+    def fetch(self, email_service, message_ids, failed_ids):
+        chunk = []
+        for message_id in message_ids:
+            chunk.append(message_id)
+            if len(chunk) == self.batch_size:
+                yield from self._fetch_chunk(email_service.service, chunk, failed_ids)
+                chunk = []
+        if chunk:
+            yield from self._fetch_chunk(email_service.service, chunk, failed_ids)
+
+    def _fetch_chunk(self, service, message_ids, failed_ids):
+        responses = {}
+        pending = message_ids
+        for attempt in range(MAX_RETRIES + 1):
+            retry = []
+
+            def callback(request_id, response, exception):
+                if exception is None:
+                    responses[request_id] = response
+                elif is_retryable(exception) and attempt < MAX_RETRIES:
+                    retry.append(request_id)
+                else:
+                    _record_failure(request_id, exception, failed_ids)
+
+            batch = service.new_batch_http_request(callback=callback)
+            for message_id in pending:
+                batch.add(service.users().messages().get(userId='me', id=message_id), request_id=message_id)
+            batch.execute()
+
+            if not retry:
+                break
+            logger.info(f"Retrying {len(retry)} rate limited messages")
+            time.sleep(RETRY_BASE_DELAY * 2 ** attempt)
+            pending = retry
+
+        # Keep list order; batch callbacks may arrive in any order
+        for message_id in message_ids:
+            if message_id in responses:
+                yield responses[message_id]
+
+class ThreadedFetcher:
+    """Fetch messages concurrently, each pool thread keeping its own Gmail client across requests."""
+
+    def __init__(self, workers=4):
+        self.workers = workers
+        self._local = threading.local()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='gmail-fetch')
+
+    def _get(self, email_service, message_id):
+        if not hasattr(self._local, 'service'):
+            self._local.service = email_service.fork()
+        try:
+            return message_id, get_with_retry(self._local.service.service, message_id), None
+        except Exception as e:
+            return message_id, None, e
+
+    def fetch(self, email_service, message_ids, failed_ids):
+        futures = [self._executor.submit(self._get, email_service, message_id) for message_id in message_ids]
+        for future in futures:
+            message_id, message, error = future.result()
+            if error is not None:
+                _record_failure(message_id, error, failed_ids)
+            else:
+                yield message
+
+FETCH_STRATEGIES = {
+    'sequential': SequentialFetcher,
+    'batched': BatchedFetcher,
+    'threaded': ThreadedFetcher
+}
+
+_fetchers = {}
+_fetchers_lock = threading.Lock()
+
+def get_fetcher(strategy):
+    """Return the shared fetch strategy registered under the given name."""
+    if strategy not in FETCH_STRATEGIES:
+        raise ValueError(f"Unknown fetch strategy: {strategy}")
+    with _fetchers_lock:
+        if strategy not in _fetchers:
+            _fetchers[strategy] = FETCH_STRATEGIES[strategy]()
+        return _fetchers[strategy]
+
+def parse(email_service, messages):
+    """Parse raw Gmail messages, dropping any that fail to parse."""
+    for message in messages:
+        email_data = email_service._parse_email(message)
+        if email_data:  # Only yield if parsing was successful
+            yield email_data
+
+def enrich(spam_filter, emails):
+    """Attach a spam score to each email."""
+    for email in emails:
+        email['spam_score'] = spam_filter.spam_score(email['subject'], email['body'])
+        yield email
+
+def compact_email(email):
+    """Reduce a parsed email to a snippet with short field names."""
+    # Gmail snippets are HTML-escaped, unlike the plain-text body
+    snippet = html.unescape(email['snippet']) if email.get('snippet') else email.get('body', '')
+    compact = {
+        'id': email['id'],
+        's': email['subject'],
+        'f': email['from'],
+        'd': email['date'],
+        'sn': snippet[:COMPACT_SNIPPET_LENGTH],
+        'u': email['is_unread'],
+        'st': email['is_starred']
+    }
+    if 'spam_score' in email:
+        compact['ss'] = email['spam_score']
+    return compact
+
+def full_email(email):
+    """Drop the snippet from the full view; it only duplicates the start of the body."""
+    return {key: value for key, value in email.items() if key != 'snippet'}
+
+def serialize(emails, view='full'):
+    """Yield emails in the requested view, 'full' or 'compact'."""
+    for email in emails:
+        yield compact_email(email) if view == 'compact' else full_email(email)
@@ -0,0 +1,132 @@
+import os
+import time
+import logging
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows dev server runs a single process, no lock needed
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Shared state entry recording the last sync attempt and consecutive failures
+STATUS_STATE = 'prefetch_status'
+
+class PrefetchScheduler:
+    """Background thread that keeps hot folders warm in the shared folder cache.
+
+    Every worker runs a scheduler, but a sync only happens when the last
+    attempt by any worker is older than the current interval and the worker
+    wins a non-blocking file lock, so at most one worker talks to Gmail at a
+    time. Failed or partial syncs back off exponentially.
+    """
+
+    TICK = 5
+
+    def __init__(self, email_service, cache, folders, min_interval=30, max_interval=240, active_window=120,
+                 max_failure_interval=900, on_sync=None):
+        self.email_service = email_service
+        self.cache = cache
+        self.folders = folders
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.active_window = active_window
+        self.max_failure_interval = max_failure_interval
+        self.on_sync = on_sync
+        self._lock_path = os.path.join(cache.cache_dir, '.prefetch.lock')
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start the scheduler thread."""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='prefetch-scheduler', daemon=True)
+        self._thread.start()
+        logger.info(f"Prefetch scheduler started for folders: {', '.join(self.folders)}")
+
+    def stop(self):
+        """Stop the scheduler thread."""
+        self._stop.set()
+
+    def current_interval(self):
+        """Sync interval: short while clients are active, doubling per idle window up to the maximum."""
+        idle = time.time() - self.cache.last_activity()
+        if idle <= self.active_window:
+            return self.min_interval
+        backoff = 2 ** min(idle / self.active_window, 16)
+        return min(self.min_interval * backoff, self.max_interval)
+
+    def retry_delay(self, status):
+        """Seconds to wait after the last attempt, doubling per consecutive failed sync."""
+        failures = status.get('failures', 0)
+        if not failures:
+            return self.current_interval()
+        return min(self.current_interval() * 2 ** failures, self.max_failure_interval)
+
+    def is_due(self):
+        """Whether any worker's last sync attempt, successful or not, is old enough to retry."""
+        status = self.cache.get_state(STATUS_STATE) or {}
+        return time.time() - status.get('last_attempt', 0) >= self.retry_delay(status)
+
+    def _run(self):
+        while True:
+            try:
+                if self.is_due():
+                    self.sync()
+            except Exception as e:
+                logger.error(f"Error in prefetch scheduler: {str(e)}")
+            if self._stop.wait(self.TICK):
+                return
+
+    def sync(self):
+        """Refresh every folder if no other worker is already syncing or has just tried."""
+        with open(self._lock_path, 'a') as lock_file:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    logger.info("Another worker is syncing, skipping prefetch")
+                    return False
+            try:
+                # Another worker may have attempted a sync between our check and the lock
+                if not self.is_due():
+                    return False
+                status = self.cache.get_state(STATUS_STATE) or {}
+                started = time.time()
+                ok = self._sync_folders()
+                failures = 0 if ok else status.get('failures', 0) + 1
+                self.cache.put_state(STATUS_STATE, {'last_attempt': started, 'failures': failures})
+                if ok:
+                    logger.info("Prefetch sync complete")
+                else:
+                    logger.warning(f"Prefetch sync failed {failures} time(s) in a row, "
+                                   f"retrying in {self.retry_delay({'failures': failures}):.0f}s")
+                return ok
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _sync_folders(self):
+        ok = True
+        for folder, fetch_name in self.folders.items():
+            result = getattr(self.email_service, fetch_name)()
+            if not result.get('success'):
+                logger.error(f"Prefetch of {folder} failed: {result.get('message')}")
+                ok = False
+                continue
+            if result.get('partial'):
+                logger.warning(f"Prefetch of {folder} incomplete, not caching it")
+                ok = False
+                continue
+            self.cache.put(folder, result)
+        if self.on_sync is not None:
+            # Still under the lock, so on_sync can safely update shared state
+            try:
+                self.on_sync(self.email_service)
+            except Exception as e:
+                logger.error(f"Error in prefetch sync hook: {str(e)}")
+                ok = False
+        return ok
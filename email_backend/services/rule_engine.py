@@ -0,0 +1,191 @@
+import re
+import json
+import logging
+from typing import List, Dict
+from .spam_filter import SpamFilter
+from .labels import SPAM_REMOVE_LABELS
+
+logger = logging.getLogger(__name__)
+
+# Parsed email fields a rule can match against
+MATCH_FIELDS = ('from', 'subject', 'body')
+
+# Shared state entry holding the Gmail history ID that rules have been applied up to
+WATERMARK_STATE = 'rules_watermark'
+
+class Rule:
+    """A compiled rule: field conditions that must all match, and the actions to take.
+
+    Each field condition is a string or list of strings matched case-insensitively
+    as substrings; entries prefixed with "re:" are regular expressions. Entries
+    for a field are OR-ed into a single compiled pattern.
+    """
+
+    def __init__(self, name: str, conditions: Dict, actions: List[str]):
+        self.name = name
+        self.patterns = {}
+        for field in MATCH_FIELDS:
+            values = conditions.get(field)
+            if values:
+                self.patterns[field] = self._compile(values)
+        self.min_spam_score = conditions.get('min_spam_score')
+        if not self.patterns and self.min_spam_score is None:
+            raise ValueError(f"Rule '{name}' has no conditions")
+
+        if not actions:
+            raise ValueError(f"Rule '{name}' has no actions")
+        self.actions = actions
+        self.add_labels = set()
+        self.remove_labels = set()
+        self.user_labels = set()
+        for action in actions:
+            if action == 'star':
+                self.add_labels.add('STARRED')
+            elif action == 'spam':
+                self.add_labels.add('SPAM')
+                self.remove_labels.update(SPAM_REMOVE_LABELS)
+            elif action == 'delete':
+                self.add_labels.add('TRASH')
+            elif action.startswith('label:'):
+                self.user_labels.add(action[len('label:'):])
+            else:
+                raise ValueError(f"Rule '{name}' has unknown action: {action}")
+
+    @staticmethod
+    def _compile(values):
+        if isinstance(values, str):
+            values = [values]
+        alternatives = [v[3:] if v.startswith('re:') else re.escape(v) for v in values]
+        return re.compile('|'.join(f'(?:{a})' for a in alternatives), re.IGNORECASE)
+
+    def matches(self, email: Dict, spam_score) -> bool:
+        for field, pattern in self.patterns.items():
+            if not pattern.search(email.get(field) or ''):
+                return False
+        if self.min_spam_score is not None and spam_score() < self.min_spam_score:
+            return False
+        return True
+
+class RuleEngine:
+    """Evaluates compiled rules over emails and applies the results as batched label changes."""
+
+    def __init__(self, rules: List[Dict], spam_filter: SpamFilter = None):
+        self.rules = [Rule(r['name'], r.get('when', {}), r.get('actions', [])) for r in rules]
+        self.spam_filter = spam_filter or SpamFilter()
+
+    @classmethod
+    def from_file(cls, path: str):
+        """Load rules from a JSON file containing a list of rule objects."""
+        with open(path) as f:
+            return cls(json.load(f))
+
+    def evaluate(self, emails: List[Dict]) -> List[Dict]:
+        """Return the rules matched by each email, skipping emails no rule matched."""
+        matches = []
+        for email in emails:
+            score = None
+
+            def spam_score():
+                # Scoring is the expensive part, so only do it once and only if a rule asks
+                nonlocal score
+                if score is None:
+                    score = self.spam_filter.spam_score(email.get('subject') or '', email.get('body') or '')
+                return score
+
+            matched = [rule for rule in self.rules if rule.matches(email, spam_score)]
+            if matched:
+                matches.append({'email': email, 'rules': matched})
+        return matches
+
+    def _plan(self, matches: List[Dict], label_ids: Dict[str, str]) -> Dict:
+        """Group message IDs by identical label changes, one batchModify per group."""
+        batches = {}
+        for match in matches:
+            add, remove = set(), set()
+            for rule in match['rules']:
+                add |= rule.add_labels
+                remove |= rule.remove_labels
+                add |= {label_ids.get(name, name) for name in rule.user_labels}
+            if 'TRASH' in add:
+                # Trashing supersedes every other change
+                add, remove = {'TRASH'}, set()
+            remove -= add
+            key = (tuple(sorted(add)), tuple(sorted(remove)))
+            batches.setdefault(key, []).append(match['email']['id'])
+        return batches
+
+    def apply(self, email_service, emails: List[Dict], dry_run: bool = False) -> Dict:
+        """Evaluate rules over emails and apply the resulting label changes in batches."""
+        try:
+            matches = self.evaluate(emails)
+            user_labels = {name for match in matches for rule in match['rules'] for name in rule.user_labels}
+            label_ids = {}
+            if user_labels and not dry_run:
+                label_ids = email_service.get_label_ids(user_labels, create_missing=True)
+            batches = self._plan(matches, label_ids)
+
+            if not dry_run:
+                for (add, remove), ids in batches.items():
+                    result = email_service.batch_modify(ids, add, remove)
+                    if not result['success']:
+                        return {'success': False, 'message': result['message']}
+
+            logger.info(f"Rules matched {len(matches)} of {len(emails)} emails (dry_run={dry_run})")
+            return {
+                'success': True,
+                'dry_run': dry_run,
+                'matches': [{
+                    'id': match['email']['id'],
+                    'subject': match['email'].get('subject'),
+                    'rules': [rule.name for rule in match['rules']],
+                    'actions': sorted({a for rule in match['rules'] for a in rule.actions})
+                } for match in matches],
+                'batches': [{
+                    'add_label_ids': list(add),
+                    'remove_label_ids': list(remove),
+                    'count': len(ids)
+                } for (add, remove), ids in batches.items()]
+            }
+
+        except Exception as e:
+            logger.error(f"Error applying rules: {str(e)}")
+            return {'success': False, 'message': str(e)}
+
+    def apply_delta(self, email_service, state, dry_run: bool = False) -> Dict:
+        """Apply rules to inbox mail added since the history watermark kept in shared state.
+
+        state is the shared FolderCache. Callers must hold the prefetch lock so
+        that only one worker reads and advances the watermark at a time.
+        """
+        empty = {'success': True, 'dry_run': dry_run, 'matches': [], 'batches': []}
+        try:
+            watermark = state.get_state(WATERMARK_STATE)
+            if watermark is None:
+                # Start from now rather than re-running rules over the existing mailbox
+                state.put_state(WATERMARK_STATE, email_service.get_history_id())
+                return empty
+
+            delta = email_service.get_new_message_ids(watermark)
+            if not delta['success']:
+                if delta.get('expired'):
+                    logger.warning("Rules watermark expired, restarting from the current history ID")
+                    state.put_state(WATERMARK_STATE, email_service.get_history_id())
+                return {'success': False, 'message': delta['message']}
+
+            result = empty
+            if delta['message_ids']:
+                emails = email_service.fetch_emails(message_ids=delta['message_ids'])
+                if not emails['success']:
+                    return {'success': False, 'message': emails['message']}
+                if emails.get('failed_ids'):
+                    # Leave the watermark alone so the next sync retries the whole delta
+                    return {'success': False, 'message': f"Failed to fetch {len(emails['failed_ids'])} new emails"}
+                result = self.apply(email_service, emails['emails'], dry_run)
+
+            if result['success']:
+                state.put_state(WATERMARK_STATE, delta['history_id'])
+            return result
+
+        except Exception as e:
+            logger.error(f"Error applying rules to new mail: {str(e)}")
+            return {'success': False, 'message': str(e)}
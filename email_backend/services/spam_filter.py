@@ -58,6 +58,23 @@ class SpamFilter:
         
         return False
     
+    def spam_score(self, subject: str, body: str) -> int:
+        """
+        Score an email by counting the spam signals it triggers
+        Higher scores mean more likely spam
+        """
+        subject_lower = subject.lower()
+        body_lower = body.lower()
+        
+        score = sum(1 for keyword in self.spam_keywords
+                    if keyword in subject_lower or keyword in body_lower)
+        score += sum(1 for pattern in self.spam_patterns
+                     if re.search(pattern, subject) or re.search(pattern, body))
+        if self._has_suspicious_characteristics(subject, body):
+            score += 1
+        
+        return score
+    
     def _has_suspicious_characteristics(self, subject: str, body: str) -> bool:
         """Check for suspicious characteristics in the email"""
         # Check for excessive punctuation
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The app imports services as a top-level package from the email_backend directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
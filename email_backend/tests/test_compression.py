@@ -0,0 +1,67 @@
+import gzip
+import json
+import pytest
+
+werkzeug = pytest.importorskip('werkzeug')
+from werkzeug.datastructures import Accept
+from werkzeug.http import parse_accept_header
+from werkzeug.wrappers import Response
+from services import compression
+
+
+class FakeBrotli:
+    @staticmethod
+    def compress(data, quality):
+        return b'br:' + data
+
+
+def accept(header):
+    return parse_accept_header(header, Accept)
+
+
+def json_response(size):
+    return Response(json.dumps({'body': 'x' * size}), mimetype='application/json')
+
+
+@pytest.fixture
+def with_brotli(monkeypatch):
+    monkeypatch.setattr(compression, 'brotli', FakeBrotli)
+
+
+@pytest.fixture
+def without_brotli(monkeypatch):
+    monkeypatch.setattr(compression, 'brotli', None)
+
+
+def test_choose_encoding_uses_gzip_without_brotli(without_brotli):
+    assert compression.choose_encoding(accept('gzip, br')) == 'gzip'
+
+
+def test_choose_encoding_prefers_brotli_at_equal_quality(with_brotli):
+    assert compression.choose_encoding(accept('gzip, br')) == 'br'
+    assert compression.choose_encoding(accept('gzip;q=1.0, br;q=0.5')) == 'gzip'
+
+
+def test_choose_encoding_none_when_nothing_accepted(with_brotli):
+    assert compression.choose_encoding(accept('identity')) is None
+
+
+def test_compress_response_gzips_large_json(without_brotli):
+    response = compression.compress_response(json_response(2000), accept('gzip'), 1024)
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    data = response.get_data()
+    assert response.headers['Content-Length'] == str(len(data))
+    assert json.loads(gzip.decompress(data))['body'] == 'x' * 2000
+
+
+def test_compress_response_skips_small_bodies_but_sets_vary(without_brotli):
+    response = compression.compress_response(json_response(10), accept('gzip'), 1024)
+    assert 'Content-Encoding' not in response.headers
+    assert 'Accept-Encoding' in response.headers['Vary']
+
+
+def test_compress_response_ignores_non_json(without_brotli):
+    response = Response('x' * 2000, mimetype='text/plain')
+    response = compression.compress_response(response, accept('gzip'), 1024)
+    assert 'Content-Encoding' not in response.headers
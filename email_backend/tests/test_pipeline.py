@@ -0,0 +1,150 @@
+import pytest
+from services import pipeline
+
+
+class FakeHttpError(Exception):
+    def __init__(self, status, content=b''):
+        super().__init__(f'HTTP {status}')
+        self.resp = type('Resp', (), {'status': status})()
+        self.content = content
+
+
+class FakeRequest:
+    def __init__(self, gmail, message_id):
+        self.gmail = gmail
+        self.message_id = message_id
+
+    def execute(self):
+        self.gmail.calls.append(self.message_id)
+        errors = self.gmail.errors.get(self.message_id)
+        if errors:
+            raise errors.pop(0)
+        return {'id': self.message_id}
+
+
+class FakeBatch:
+    def __init__(self, gmail, callback):
+        self.gmail = gmail
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, request_id):
+        self.requests.append((request_id, request))
+
+    def execute(self):
+        self.gmail.batches.append([request_id for request_id, _ in self.requests])
+        # Gmail may answer batch parts in any order
+        for request_id, request in reversed(self.requests):
+            try:
+                self.callback(request_id, request.execute(), None)
+            except Exception as e:
+                self.callback(request_id, None, e)
+
+
+class FakeGmail:
+    """Just enough of the Gmail client for the fetch strategies."""
+
+    def __init__(self, errors=None):
+        self.errors = errors or {}
+        self.calls = []
+        self.batches = []
+
+    def users(self):
+        return self
+
+    def messages(self):
+        return self
+
+    def get(self, userId, id):
+        return FakeRequest(self, id)
+
+    def new_batch_http_request(self, callback):
+        return FakeBatch(self, callback)
+
+
+class FakeEmailService:
+    def __init__(self, gmail):
+        self.service = gmail
+        self.forks = 0
+
+    def fork(self):
+        self.forks += 1
+        return FakeEmailService(self.service)
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(pipeline, 'RETRY_BASE_DELAY', 0)
+
+
+def fetch(fetcher, gmail, ids):
+    failed_ids = []
+    messages = list(fetcher.fetch(FakeEmailService(gmail), ids, failed_ids))
+    return [m['id'] for m in messages], failed_ids
+
+
+def test_is_retryable_covers_rate_limits_only():
+    assert pipeline.is_retryable(FakeHttpError(429))
+    assert pipeline.is_retryable(FakeHttpError(503))
+    assert pipeline.is_retryable(FakeHttpError(403, b'{"reason": "userRateLimitExceeded"}'))
+    assert not pipeline.is_retryable(FakeHttpError(403, b'{"reason": "forbidden"}'))
+    assert not pipeline.is_retryable(FakeHttpError(404))
+
+
+def test_batched_retries_rate_limited_messages_in_order():
+    gmail = FakeGmail(errors={'2': [FakeHttpError(429), FakeHttpError(429)]})
+    ids, failed_ids = fetch(pipeline.BatchedFetcher(batch_size=2), gmail, ['1', '2', '3'])
+    assert ids == ['1', '2', '3']
+    assert failed_ids == []
+    assert gmail.batches == [['1', '2'], ['2'], ['2'], ['3']]
+
+
+def test_batched_reports_messages_that_keep_failing():
+    gmail = FakeGmail(errors={'2': [FakeHttpError(429)] * (pipeline.MAX_RETRIES + 1)})
+    ids, failed_ids = fetch(pipeline.BatchedFetcher(), gmail, ['1', '2'])
+    assert ids == ['1']
+    assert failed_ids == ['2']
+
+
+def test_deleted_messages_are_skipped_not_reported():
+    gmail = FakeGmail(errors={'2': [FakeHttpError(404)]})
+    ids, failed_ids = fetch(pipeline.BatchedFetcher(), gmail, ['1', '2'])
+    assert ids == ['1']
+    assert failed_ids == []
+
+
+def test_sequential_retries_then_reports():
+    gmail = FakeGmail(errors={
+        '1': [FakeHttpError(500)],
+        '2': [FakeHttpError(400)]
+    })
+    ids, failed_ids = fetch(pipeline.SequentialFetcher(), gmail, ['1', '2'])
+    assert ids == ['1']
+    assert failed_ids == ['2']
+    assert gmail.calls == ['1', '1', '2']
+
+
+def test_threaded_keeps_per_thread_clients_across_requests():
+    fetcher = pipeline.ThreadedFetcher(workers=2)
+    service = FakeEmailService(FakeGmail())
+    for _ in range(3):
+        failed_ids = []
+        messages = list(fetcher.fetch(service, ['1', '2', '3', '4'], failed_ids))
+        assert [m['id'] for m in messages] == ['1', '2', '3', '4']
+    assert service.forks <= 2
+
+
+def test_get_fetcher_reuses_instances():
+    assert pipeline.get_fetcher('threaded') is pipeline.get_fetcher('threaded')
+    with pytest.raises(ValueError):
+        pipeline.get_fetcher('carrier-pigeon')
+
+
+def test_full_view_drops_snippet():
+    email = {'id': '1', 'subject': 'S', 'from': 'f', 'date': '', 'body': 'I\'m "here" & there',
+             'snippet': 'I&#39;m &quot;here&quot; &amp; there', 'is_unread': True, 'is_starred': False}
+    full, = pipeline.serialize([email])
+    compact, = pipeline.serialize([email], 'compact')
+    assert 'snippet' not in full and full['body'] == 'I\'m "here" & there'
+    # Gmail snippets are HTML-escaped; the compact view must match the plain-text body
+    assert compact['sn'] == 'I\'m "here" & there' and 'body' not in compact
@@ -0,0 +1,124 @@
+import os
+import time
+import pytest
+from services.folder_cache import FolderCache
+from services.prefetch import PrefetchScheduler, STATUS_STATE
+
+
+class FakeEmailService:
+    def __init__(self, result=None):
+        self.result = result or {'success': True, 'emails': []}
+        self.calls = 0
+
+    def receive_emails(self):
+        self.calls += 1
+        return self.result
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return FolderCache(cache_dir=str(tmp_path))
+
+
+def scheduler(cache, service, **kwargs):
+    kwargs.setdefault('min_interval', 30)
+    kwargs.setdefault('max_interval', 240)
+    kwargs.setdefault('active_window', 120)
+    return PrefetchScheduler(service, cache, {'inbox': 'receive_emails'}, **kwargs)
+
+
+def set_activity(cache, seconds_ago):
+    cache.mark_activity()
+    stamp = time.time() - seconds_ago
+    os.utime(cache._activity_file, (stamp, stamp))
+
+
+def age_last_attempt(cache, seconds):
+    status = cache.get_state(STATUS_STATE)
+    status['last_attempt'] -= seconds
+    cache.put_state(STATUS_STATE, status)
+
+
+def test_current_interval_is_short_while_active(cache):
+    set_activity(cache, 10)
+    assert scheduler(cache, FakeEmailService()).current_interval() == 30
+
+
+def test_current_interval_backs_off_when_idle(cache):
+    prefetch = scheduler(cache, FakeEmailService())
+    set_activity(cache, 240)
+    assert prefetch.current_interval() == pytest.approx(120, rel=0.01)
+    set_activity(cache, 10 ** 6)
+    assert prefetch.current_interval() == 240
+
+
+def test_successful_sync_waits_for_the_interval(cache):
+    set_activity(cache, 0)
+    service = FakeEmailService()
+    prefetch = scheduler(cache, service)
+
+    assert prefetch.is_due()
+    assert prefetch.sync()
+    assert cache.get('inbox') == service.result
+    assert not prefetch.is_due()
+    assert not prefetch.sync()
+    assert service.calls == 1
+
+    age_last_attempt(cache, 30)
+    assert prefetch.is_due()
+
+
+@pytest.mark.parametrize('result', [
+    {'success': False, 'message': 'quota', 'emails': []},
+    {'success': True, 'emails': [], 'partial': True, 'failed_ids': ['1']}
+])
+def test_failed_sync_backs_off(cache, result):
+    set_activity(cache, 0)
+    service = FakeEmailService(result)
+    prefetch = scheduler(cache, service)
+
+    assert not prefetch.sync()
+    assert cache.get('inbox') is None
+    assert cache.get_state(STATUS_STATE)['failures'] == 1
+    assert not prefetch.is_due()
+
+    # One failure doubles the wait, so a single interval is not enough
+    age_last_attempt(cache, 30)
+    assert not prefetch.is_due()
+    age_last_attempt(cache, 30)
+    assert prefetch.sync() is False
+    assert cache.get_state(STATUS_STATE)['failures'] == 2
+
+    # Recovery resets the backoff
+    service.result = {'success': True, 'emails': []}
+    age_last_attempt(cache, 120)
+    assert prefetch.sync()
+    assert cache.get_state(STATUS_STATE)['failures'] == 0
+
+
+def test_failure_backoff_is_capped(cache):
+    set_activity(cache, 0)
+    prefetch = scheduler(cache, FakeEmailService(), max_failure_interval=300)
+    assert prefetch.retry_delay({'failures': 20}) == 300
+
+
+def test_failing_hook_counts_as_failure(cache):
+    def on_sync(service):
+        raise RuntimeError('rules broke')
+
+    prefetch = scheduler(cache, FakeEmailService(), on_sync=on_sync)
+    assert not prefetch.sync()
+    assert cache.get_state(STATUS_STATE)['failures'] == 1
+
+
+def test_run_loop_does_not_hammer_gmail_after_failure(cache, monkeypatch):
+    set_activity(cache, 0)
+    monkeypatch.setattr(PrefetchScheduler, 'TICK', 0.01)
+    service = FakeEmailService({'success': False, 'message': 'rate limited', 'emails': []})
+    prefetch = scheduler(cache, service)
+
+    prefetch.start()
+    time.sleep(0.3)
+    prefetch.stop()
+    prefetch._thread.join(1)
+    assert service.calls == 1
@@ -0,0 +1,216 @@
+import pytest
+from services.folder_cache import FolderCache
+from services.labels import SPAM_REMOVE_LABELS
+from services.rule_engine import Rule, RuleEngine, WATERMARK_STATE
+
+
+def email(message_id, sender='someone@example.com', subject='Hello', body='Lunch tomorrow?'):
+    return {'id': message_id, 'from': sender, 'subject': subject, 'body': body}
+
+
+class FakeSpamFilter:
+    def __init__(self, score):
+        self.score = score
+        self.calls = 0
+
+    def spam_score(self, subject, body):
+        self.calls += 1
+        return self.score
+
+
+class FakeEmailService:
+    """Stands in for EmailService with an in-memory mailbox and history."""
+
+    def __init__(self, history_id='100'):
+        self.history_id = history_id
+        self.mailbox = {}
+        self.new_ids = []
+        self.history_result = None
+        self.modified = []
+
+    def get_history_id(self):
+        return self.history_id
+
+    def get_new_message_ids(self, start_history_id, label_id='INBOX'):
+        if self.history_result is not None:
+            return self.history_result
+        return {'success': True, 'message_ids': self.new_ids, 'history_id': self.history_id}
+
+    def fetch_emails(self, message_ids=None, **kwargs):
+        return {'success': True, 'emails': [self.mailbox[i] for i in message_ids]}
+
+    def get_label_ids(self, names=None, create_missing=False):
+        return {name: f'Label_{name}' for name in names}
+
+    def batch_modify(self, message_ids, add_label_ids=None, remove_label_ids=None):
+        self.modified.append((list(message_ids), tuple(add_label_ids), tuple(remove_label_ids)))
+        return {'success': True}
+
+
+def test_compile_matches_substrings_case_insensitively():
+    pattern = Rule._compile(['Invoice', 'a.b'])
+    assert pattern.search('your INVOICE is ready')
+    assert pattern.search('see a.b')
+    # Plain entries are escaped, so "." is not a wildcard
+    assert not pattern.search('see axb')
+
+
+def test_compile_supports_regex_entries():
+    pattern = Rule._compile('re:order #\\d+')
+    assert pattern.search('Your Order #123')
+    assert not pattern.search('Your order #abc')
+
+
+def test_rule_rejects_unknown_actions_and_empty_conditions():
+    with pytest.raises(ValueError):
+        Rule('bad', {'subject': 'x'}, ['archive'])
+    with pytest.raises(ValueError):
+        Rule('empty', {}, ['star'])
+    with pytest.raises(ValueError):
+        Rule('idle', {'subject': 'x'}, [])
+    with pytest.raises(ValueError):
+        RuleEngine([{'name': 'idle', 'when': {'subject': 'x'}}])
+
+
+def test_evaluate_requires_every_condition():
+    engine = RuleEngine([{'name': 'boss', 'when': {'from': 'boss@', 'subject': 'urgent'}, 'actions': ['star']}])
+    matches = engine.evaluate([
+        email('1', sender='boss@example.com', subject='Urgent: numbers'),
+        email('2', sender='boss@example.com', subject='Weekly'),
+        email('3', subject='urgent')
+    ])
+    assert [m['email']['id'] for m in matches] == ['1']
+
+
+def test_evaluate_scores_spam_lazily_and_once():
+    spam_filter = FakeSpamFilter(score=12)
+    engine = RuleEngine([
+        {'name': 'a', 'when': {'min_spam_score': 10}, 'actions': ['spam']},
+        {'name': 'b', 'when': {'min_spam_score': 11}, 'actions': ['star']},
+        {'name': 'c', 'when': {'subject': 'receipt'}, 'actions': ['star']}
+    ], spam_filter=spam_filter)
+
+    matches = engine.evaluate([email('1')])
+    assert [r.name for r in matches[0]['rules']] == ['a', 'b']
+    assert spam_filter.calls == 1
+
+    spam_filter.calls = 0
+    RuleEngine([{'name': 'c', 'when': {'subject': 'receipt'}, 'actions': ['star']}],
+               spam_filter=spam_filter).evaluate([email('1')])
+    assert spam_filter.calls == 0
+
+
+def test_plan_groups_identical_changes_into_one_batch():
+    engine = RuleEngine([{'name': 'r', 'when': {'subject': 'receipt'}, 'actions': ['label:Receipts', 'star']}])
+    matches = engine.evaluate([email('1', subject='receipt'), email('2', subject='Receipt #2')])
+    batches = engine._plan(matches, {'Receipts': 'Label_7'})
+    assert batches == {(('Label_7', 'STARRED'), ()): ['1', '2']}
+
+
+def test_plan_trash_overrides_other_changes():
+    engine = RuleEngine([
+        {'name': 'spam', 'when': {'subject': 'prize'}, 'actions': ['spam', 'star']},
+        {'name': 'delete', 'when': {'subject': 'prize'}, 'actions': ['delete']}
+    ])
+    batches = engine._plan(engine.evaluate([email('1', subject='prize')]), {})
+    assert batches == {(('TRASH',), ()): ['1']}
+
+
+def test_plan_never_removes_a_label_it_adds():
+    engine = RuleEngine([
+        {'name': 'spam', 'when': {'subject': 'prize'}, 'actions': ['spam']},
+        {'name': 'keep', 'when': {'subject': 'prize'}, 'actions': ['label:INBOX']}
+    ])
+    (add, remove), = engine._plan(engine.evaluate([email('1', subject='prize')]), {}).keys()
+    assert 'INBOX' in add
+    assert 'INBOX' not in remove
+    assert set(remove) == set(SPAM_REMOVE_LABELS) - {'INBOX'}
+
+
+def test_apply_dry_run_reports_without_modifying():
+    service = FakeEmailService()
+    engine = RuleEngine([{'name': 'r', 'when': {'subject': 'receipt'}, 'actions': ['label:Receipts']}])
+    result = engine.apply(service, [email('1', subject='receipt')], dry_run=True)
+    assert result['success'] and result['dry_run']
+    assert result['matches'][0]['rules'] == ['r']
+    assert service.modified == []
+
+
+@pytest.fixture
+def state(tmp_path):
+    return FolderCache(cache_dir=str(tmp_path))
+
+
+def star_engine():
+    return RuleEngine([{'name': 'star', 'when': {'subject': 'hello'}, 'actions': ['star']}])
+
+
+def test_apply_delta_first_run_only_records_watermark(state):
+    service = FakeEmailService(history_id='100')
+    service.new_ids = ['1']
+    service.mailbox['1'] = email('1')
+
+    result = star_engine().apply_delta(service, state)
+    assert result['matches'] == []
+    assert service.modified == []
+    assert state.get_state(WATERMARK_STATE) == '100'
+
+
+def test_apply_delta_applies_new_mail_and_advances_watermark(state):
+    state.put_state(WATERMARK_STATE, '100')
+    service = FakeEmailService(history_id='150')
+    service.new_ids = ['1', '2']
+    service.mailbox.update({'1': email('1'), '2': email('2', subject='Weekly')})
+
+    result = star_engine().apply_delta(service, state)
+    assert [m['id'] for m in result['matches']] == ['1']
+    assert service.modified == [(['1'], ('STARRED',), ())]
+    assert state.get_state(WATERMARK_STATE) == '150'
+
+
+def test_apply_delta_watermark_is_shared_across_engines(state):
+    state.put_state(WATERMARK_STATE, '100')
+    service = FakeEmailService(history_id='150')
+    service.new_ids = ['1']
+    service.mailbox['1'] = email('1')
+    star_engine().apply_delta(service, state)
+
+    # A restarted worker reads the stored watermark and sees no new mail
+    service.new_ids = []
+    service.modified = []
+    result = star_engine().apply_delta(service, state)
+    assert result['matches'] == []
+    assert service.modified == []
+
+
+def test_apply_delta_keeps_watermark_when_apply_fails(state):
+    state.put_state(WATERMARK_STATE, '100')
+    service = FakeEmailService(history_id='150')
+    service.new_ids = ['1']
+    service.mailbox['1'] = email('1')
+    service.batch_modify = lambda *args: {'success': False, 'message': 'rate limited'}
+
+    result = star_engine().apply_delta(service, state)
+    assert not result['success']
+    assert state.get_state(WATERMARK_STATE) == '100'
+
+
+def test_apply_delta_restarts_from_current_history_when_expired(state):
+    state.put_state(WATERMARK_STATE, '1')
+    service = FakeEmailService(history_id='900')
+    service.history_result = {'success': False, 'message': 'not found', 'expired': True}
+
+    result = star_engine().apply_delta(service, state)
+    assert not result['success']
+    assert state.get_state(WATERMARK_STATE) == '900'
+
+
+def test_apply_delta_keeps_watermark_when_fetch_is_partial(state):
+    state.put_state(WATERMARK_STATE, '100')
+    service = FakeEmailService(history_id='150')
+    service.fetch_emails = lambda **kwargs: {'success': True, 'emails': [], 'partial': True, 'failed_ids': ['1']}
+    service.new_ids = ['1']
+
+    result = star_engine().apply_delta(service, state)
+    assert not result['success']
+    assert state.get_state(WATERMARK_STATE) == '100'